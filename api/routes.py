@@ -1,117 +1,223 @@
 import sys
 import os
+from functools import lru_cache
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from fastapi import APIRouter, HTTPException, Query
-from sklearn.metrics.pairwise import cosine_similarity
 from rapidfuzz import process, fuzz
-from model.loader import movies, tfidf_matrix
-from database.history import save_search, get_search_history
-from database.connection import get_connection
+from rapidfuzz.distance import Levenshtein
+from model.loader import (
+    movies, tfidf_matrix, title_best_idx, titles_lower, bigram_index,
+)
+from database.history import (
+    save_search, get_search_history, encode_cursor, decode_cursor,
+)
+from database.connection import get_connection, execute_prepared
 import numpy as np
+import pandas as pd
 
 router = APIRouter()
 
-# Pre-compute list of titles for fuzzy matching
-_all_titles = movies["primaryTitle"].tolist()
+# Movie details + cast/crew for one tconst, prepared once per pooled connection
+_MOVIE_DETAILS_SQL = """
+    SELECT
+        (SELECT row_to_json(m) FROM (
+            SELECT original_title, runtime_minutes
+            FROM movies WHERE tconst = $1
+        ) m) AS movie,
+        (SELECT json_agg(row_to_json(c) ORDER BY c.ordering) FROM (
+            SELECT n.primary_name AS name, p.category AS role,
+                   p.characters, p.ordering
+            FROM principals p JOIN names n ON p.nconst = n.nconst
+            WHERE p.tconst = $1
+        ) c) AS cast_info
+"""
+
+_NO_ROWS = np.array([], dtype=np.int32)
+
+# Number of fuzzy candidates re-ranked by edit distance
+_FUZZY_CANDIDATES = 10
 
 # Pre-compute normalised ratings for hybrid scoring (0-1 range)
 _max_votes = movies["numVotes"].max() or 1
 _norm_rating = (movies["averageRating"].fillna(0) / 10).to_numpy()
 _norm_votes = (np.log1p(movies["numVotes"].fillna(0)) /
                np.log1p(_max_votes))
+_num_votes = movies["numVotes"].fillna(0).to_numpy()
+
+# Popularity signal: geometric mean of normalised rating & log-votes
+_pop = np.sqrt(_norm_rating * _norm_votes.to_numpy())
+# Rows ordered by popularity, for candidates with zero cosine similarity
+_pop_order = np.argsort(_pop)[::-1]
 
 
 def fuzzy_find(title: str, score_cutoff: int = 50):
     """Return the closest matching movie title using fuzzy matching."""
-    result = process.extractOne(
-        title, _all_titles, scorer=fuzz.WRatio, score_cutoff=score_cutoff
+    query = title.lower()
+
+    # Batch stage: choices are already lowercased, so skip rapidfuzz's
+    # per-call processing; score_cutoff lets it prune by length in C.
+    candidates = process.extract(
+        query, titles_lower, scorer=fuzz.ratio, processor=None,
+        score_cutoff=score_cutoff, limit=_FUZZY_CANDIDATES,
     )
-    if result is None:
+    if not candidates:
         return None
-    matched_title, _score, _index = result
-    return matched_title
+
+    # fuzz.ratio decides; Levenshtein distance only breaks ties among the
+    # candidates sharing the best ratio score.
+    best_score = candidates[0][1]
+    tied = [index for _matched, score, index in candidates if score == best_score]
+    best_index = min(
+        tied, key=lambda index: Levenshtein.distance(query, titles_lower[index])
+    )
+    return movies["primaryTitle"].iat[best_index]
+
+
+def substring_find(title: str):
+    """Return row positions whose title contains *title* (case-insensitive)."""
+    query = title.lower()
+    bigrams = {query[j:j + 2] for j in range(len(query) - 1)}
+    if not bigrams:
+        return np.array([i for i, t in enumerate(titles_lower) if query in t],
+                        dtype=np.int32)
+
+    # Intersect posting lists smallest first; they are sorted and unique
+    postings = sorted((bigram_index.get(bg, _NO_ROWS) for bg in bigrams), key=len)
+    candidates = postings[0]
+    for rows in postings[1:]:
+        if not len(candidates):
+            break
+        candidates = np.intersect1d(candidates, rows, assume_unique=True)
+    return np.array([i for i in candidates if query in titles_lower[i]],
+                    dtype=np.int32)
 
 
 def _lookup_movie(title: str):
     """
     Find the best DataFrame row for *title*.
 
-    Returns (matches_df, fuzzy_used, matched_title).
+    Returns (idx, fuzzy_used, matched_title), where idx is the row position
+    of the most-voted matching movie.
     Raises HTTPException(404) if nothing found.
     """
     # 1. exact match
-    matches = movies[movies["primaryTitle"].str.lower() == title.lower()]
+    idx = title_best_idx.get(title.lower())
 
     # 2. substring match
-    if matches.empty:
-        matches = movies[movies["primaryTitle"].str.contains(
-            title, case=False, na=False, regex=False
-        )]
+    if idx is None:
+        positions = substring_find(title)
+        if len(positions):
+            idx = int(positions[np.argmax(_num_votes[positions])])
 
     # 3. fuzzy match
     fuzzy_used = False
     matched_title = title
-    if matches.empty:
+    if idx is None:
         fuzzy_match = fuzzy_find(title)
         if fuzzy_match:
-            matches = movies[movies["primaryTitle"].str.lower() == fuzzy_match.lower()]
+            idx = title_best_idx.get(fuzzy_match.lower())
             fuzzy_used = True
             matched_title = fuzzy_match
 
-    if matches.empty:
+    if idx is None:
         raise HTTPException(status_code=404, detail="Movie not found")
 
-    return matches, fuzzy_used, matched_title
+    return idx, fuzzy_used, matched_title
 
 
 def _hybrid_scores(idx: int, n: int):
     """
     Blend cosine similarity (70 %) with a popularity/rating signal (30 %).
-    Returns (top_indices, raw_sim_scores).
-    """
-    cos_sim = cosine_similarity(tfidf_matrix[idx], tfidf_matrix).flatten()
-    cos_sim[idx] = -1  # exclude self
-
-    # Popularity signal: geometric mean of normalised rating & log-votes
-    pop = np.sqrt(_norm_rating * _norm_votes)
+    Returns (top_indices, sim_scores) for the top n rows, best first.
 
-    hybrid = 0.70 * cos_sim + 0.30 * pop
-    hybrid[idx] = -1
+    Only rows sharing a term with *idx* have non-zero cosine similarity, so
+    those are scored from the sparse product; every other row scores on
+    popularity alone, and only the n most popular of them can compete.
+    """
+    # Rows are L2-normalised at load time, so the dot product is the cosine
+    sims = (tfidf_matrix @ tfidf_matrix[idx].T).tocoo()
+    keep = sims.row != idx  # exclude self
+    rows, cos_sim = sims.row[keep], sims.data[keep]
 
-    top_indices = hybrid.argsort()[-n:][::-1]
-    return top_indices, cos_sim
+    head = _pop_order[:n + len(rows) + 1]
+    fill = head[~np.isin(head, rows) & (head != idx)][:n]
 
+    cand_rows = np.concatenate([rows, fill])
+    cand_cos = np.concatenate([cos_sim, np.zeros(len(fill), dtype=cos_sim.dtype)])
+    hybrid = 0.70 * cand_cos + 0.30 * _pop[cand_rows]
 
-@router.get("/health")
-def health():
-    return {"status": "ok"}
+    # Partial selection of the top n, then sort only those n
+    n = min(n, len(hybrid))
+    top = np.argpartition(hybrid, -n)[-n:]
+    order = top[np.argsort(hybrid[top])[::-1]]
+    return cand_rows[order], cand_cos[order]
 
 
-@router.get("/recommend")
-def recommend(title: str, n: int = 10):
-    matches, fuzzy_used, matched_title = _lookup_movie(title)
+@lru_cache(maxsize=4096)
+def _recommend_cached(title_lower: str, n: int):
+    """
+    Compute recommendations for an already-lowercased title.
 
-    idx = matches.sort_values("numVotes", ascending=False).index[0]
+    Returns (records, fuzzy_title) where fuzzy_title is None unless the
+    fuzzy matcher was needed. Cached because popular titles repeat often.
+    """
+    idx, fuzzy_used, matched_title = _lookup_movie(title_lower)
     top_indices, cos_scores = _hybrid_scores(idx, n)
 
     results = movies.iloc[top_indices][
         ["primaryTitle", "startYear", "genres", "averageRating"]
     ].copy()
-    results["similarity"] = cos_scores[top_indices]
+    results["similarity"] = cos_scores
+
+    records = tuple(results.to_dict(orient="records"))
+    return records, (matched_title if fuzzy_used else None)
+
+
+@lru_cache(maxsize=4096)
+def _movie_details(tconst: str):
+    """
+    Fetch (original_title, runtime_minutes, cast) for *tconst* from PostgreSQL.
+
+    Movie details and cast/crew come back from a single prepared statement
+    (one round trip). Database errors propagate so that failures are never
+    cached.
+    """
+    with get_connection() as conn:
+        cur = conn.cursor()
+        execute_prepared(conn, cur, "movie_details", _MOVIE_DETAILS_SQL, (tconst,))
+        movie, cast_info = cur.fetchone()
+        cur.close()
+
+    movie = movie or {}
+    return (
+        movie.get("original_title"),
+        movie.get("runtime_minutes"),
+        tuple(cast_info or ()),
+    )
+
+
+@router.get("/health")
+def health():
+    return {"status": "ok"}
+
+
+@router.get("/recommend")
+def recommend(title: str, n: int = Query(10, ge=1, le=100)):
+    records, fuzzy_title = _recommend_cached(title.lower(), n)
 
     return {
-        "recommendations": results.to_dict(orient="records"),
-        "matched_title": matched_title,
-        "fuzzy_match": fuzzy_used,
+        "recommendations": list(records),
+        "matched_title": fuzzy_title or title,
+        "fuzzy_match": fuzzy_title is not None,
     }
 
 
 @router.get("/search")
 def search_movie(title: str = Query(..., description="Movie title to search for")):
     try:
-        matches, fuzzy_used, matched_title = _lookup_movie(title)
+        idx, fuzzy_used, matched_title = _lookup_movie(title)
     except HTTPException:
         try:
             save_search(search_query=title, matched_title=None)
@@ -119,7 +225,7 @@ def search_movie(title: str = Query(..., description="Movie title to search for"
             pass
         raise
 
-    best_match = matches.sort_values("numVotes", ascending=False).iloc[0]
+    best_match = movies.iloc[idx]
 
     try:
         save_search(search_query=title, matched_title=best_match["primaryTitle"])
@@ -130,36 +236,21 @@ def search_movie(title: str = Query(..., description="Movie title to search for"
         "tconst", "primaryTitle", "startYear", "genres",
         "averageRating", "numVotes", "director_names",
     ]
-    result = best_match[result_columns].to_dict()
-
-    # Replace NaN floats with None for clean JSON
-    result = {k: (None if isinstance(v, float) and v != v else v)
-              for k, v in result.items()}
+    # Replace missing values (NaN/NaT/NA) with None for clean JSON
+    row = best_match[result_columns].to_dict()
+    result = {k: (None if pd.isna(v) else v) for k, v in row.items()}
 
     # Extra details from PostgreSQL
     tconst = result["tconst"]
     try:
-        conn = get_connection()
-        try:
-            cur = conn.cursor()
-            cur.execute(
-                "SELECT original_title, runtime_minutes FROM movies WHERE tconst = %s",
-                (tconst,),
-            )
-            row = cur.fetchone()
-            cur.close()
-        finally:
-            conn.close()
-
-        if row:
-            result["originalTitle"] = row[0]
-            result["runtimeMinutes"] = row[1]
-        else:
-            result["originalTitle"] = None
-            result["runtimeMinutes"] = None
+        original_title, runtime_minutes, cast = _movie_details(tconst)
+        result["originalTitle"] = original_title
+        result["runtimeMinutes"] = runtime_minutes
+        result["cast"] = list(cast)
     except Exception:
         result["originalTitle"] = None
         result["runtimeMinutes"] = None
+        result["cast"] = []
 
     if fuzzy_used:
         result["fuzzy_match"] = True
@@ -169,11 +260,24 @@ def search_movie(title: str = Query(..., description="Movie title to search for"
 
 
 @router.get("/history")
-def search_history(limit: int = Query(50, ge=1, le=500)):
+def search_history(
+    limit: int = Query(50, ge=1, le=500),
+    before: str | None = Query(
+        None, description="Return searches older than this cursor (from next_cursor)"
+    ),
+):
+    try:
+        cursor = decode_cursor(before) if before else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid history cursor")
+
     try:
-        history = get_search_history(limit=limit)
+        history = get_search_history(limit=limit, before=cursor)
     except Exception as e:
         raise HTTPException(
             status_code=500, detail=f"Could not retrieve search history: {e}"
         )
-    return history
+
+    # A full page means there may be more; resume after its last entry
+    next_cursor = encode_cursor(history[-1]) if len(history) == limit else None
+    return {"items": history, "next_cursor": next_cursor}
@@ -18,6 +18,8 @@ async def lifespan(app: FastAPI):
     except Exception as e:
         print(f"Warning: Could not initialize search history table: {e}")
     yield
+    from database.connection import close_pool
+    close_pool()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -1,50 +1,69 @@
 import sys
 import os
+from datetime import datetime
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from database.connection import get_connection
 
+# History is ordered by (searched_at, id), newest first; rows without a
+# timestamp sort last instead of breaking the keyset comparison
+_SORT_KEY = "COALESCE(searched_at, '-infinity'::timestamp)"
+
 
 def init_search_history_table():
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS search_history (
-            id SERIAL PRIMARY KEY,
-            search_query VARCHAR(512) NOT NULL,
-            matched_title VARCHAR(512),
-            searched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        );
-    """)
-    conn.commit()
-    cur.close()
-    conn.close()
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS search_history (
+                id SERIAL PRIMARY KEY,
+                search_query VARCHAR(512) NOT NULL,
+                matched_title VARCHAR(512),
+                searched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+        cur.execute(f"""
+            CREATE INDEX IF NOT EXISTS idx_history_searched_at_id
+            ON search_history (({_SORT_KEY}) DESC, id DESC);
+        """)
+        conn.commit()
+        cur.close()
 
 
 def save_search(search_query: str, matched_title: str | None):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO search_history (search_query, matched_title) VALUES (%s, %s)",
-        (search_query, matched_title),
-    )
-    conn.commit()
-    cur.close()
-    conn.close()
-
-
-def get_search_history(limit: int = 50):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        "SELECT id, search_query, matched_title, searched_at "
-        "FROM search_history ORDER BY searched_at DESC LIMIT %s",
-        (limit,),
-    )
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "INSERT INTO search_history (search_query, matched_title) VALUES (%s, %s)",
+            (search_query, matched_title),
+        )
+        conn.commit()
+        cur.close()
+
+
+def get_search_history(limit: int = 50, before: tuple[datetime | None, int] | None = None):
+    """
+    Return up to *limit* searches, newest first.
+
+    *before* is a keyset cursor (searched_at, id) as returned by
+    decode_cursor(): only searches after it in that order are returned, so
+    later pages walk the (searched_at, id) index instead of re-sorting the
+    table, and rows sharing a timestamp are never skipped.
+    """
+    query = "SELECT id, search_query, matched_title, searched_at FROM search_history"
+    params = []
+    if before is not None:
+        searched_at, row_id = before
+        query += f" WHERE ({_SORT_KEY}, id) < (%s::timestamp, %s)"
+        params += [searched_at or "-infinity", row_id]
+    query += f" ORDER BY {_SORT_KEY} DESC, id DESC LIMIT %s"
+    params.append(limit)
+
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(query, params)
+        rows = cur.fetchall()
+        cur.close()
     return [
         {
             "id": row[0],
@@ -54,3 +73,17 @@ def get_search_history(limit: int = 50):
         }
         for row in rows
     ]
+
+
+def encode_cursor(entry: dict) -> str:
+    """Build the opaque ``searched_at,id`` cursor pointing after *entry*."""
+    return f"{entry['searched_at'] or ''},{entry['id']}"
+
+
+def decode_cursor(cursor: str) -> tuple[datetime | None, int]:
+    """Parse a cursor from encode_cursor(); raises ValueError if malformed."""
+    searched_at, sep, row_id = cursor.rpartition(",")
+    if not sep:
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+    return (datetime.fromisoformat(searched_at) if searched_at else None,
+            int(row_id))
@@ -11,9 +11,33 @@ CREATE TABLE IF NOT EXISTS movies (
     soup TEXT
 );
 
+CREATE TABLE IF NOT EXISTS names (
+    nconst VARCHAR(12) PRIMARY KEY,
+    primary_name VARCHAR(512),
+    birth_year INT,
+    death_year INT,
+    primary_profession VARCHAR(256)
+);
+
+CREATE TABLE IF NOT EXISTS principals (
+    tconst VARCHAR(12) NOT NULL,
+    ordering INT,
+    nconst VARCHAR(12),
+    category VARCHAR(64),
+    job TEXT,
+    characters TEXT
+);
+
+-- /search looks up cast by tconst ordered by billing; names join on nconst (PK)
+CREATE INDEX IF NOT EXISTS idx_principals_tconst_ordering ON principals (tconst, ordering);
+
 CREATE TABLE IF NOT EXISTS search_history (
     id SERIAL PRIMARY KEY,
     search_query VARCHAR(512) NOT NULL,
     matched_title VARCHAR(512),
     searched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
+
+-- /history pages newest-first with keyset pagination on (searched_at, id)
+CREATE INDEX IF NOT EXISTS idx_history_searched_at_id
+    ON search_history ((COALESCE(searched_at, '-infinity'::timestamp)) DESC, id DESC);
@@ -17,12 +17,31 @@ import sys
 import io
 import time
 import pandas as pd
+import pyarrow as pa
+from pyarrow import csv as pa_csv
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-from connection import get_connection
+from connection import connect
 
 DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "dataset", "data")
 MIN_VOTES = 100
+COPY_CHUNK_ROWS = 500_000
+
+# Same index as init.sql; rebuilt once after the bulk load instead of per row
+PRINCIPALS_INDEX_SQL = (
+    "CREATE INDEX IF NOT EXISTS idx_principals_tconst_ordering "
+    "ON principals (tconst, ordering);"
+)
+
+
+def read_tsv(filename, **kwargs):
+    """Read an IMDb TSV with the multithreaded pyarrow parser into Arrow-backed columns."""
+    return pd.read_csv(
+        os.path.join(DATA_DIR, filename),
+        sep="\t", na_values=["\\N"],
+        engine="pyarrow", dtype_backend="pyarrow",
+        **kwargs
+    )
 
 
 def load_and_process():
@@ -30,9 +49,8 @@ def load_and_process():
 
     # 1. Load title.basics.tsv — filter to movies
     print("Loading title.basics.tsv...")
-    basics = pd.read_csv(
-        os.path.join(DATA_DIR, "title.basics.tsv"),
-        sep="\t", dtype=str, na_values="\\N",
+    basics = read_tsv(
+        "title.basics.tsv", dtype=str,
         usecols=["tconst", "titleType", "primaryTitle", "originalTitle",
                  "startYear", "runtimeMinutes", "genres"]
     )
@@ -44,55 +62,53 @@ def load_and_process():
 
     # 2. Load title.ratings.tsv — merge and filter
     print("Loading title.ratings.tsv...")
-    ratings = pd.read_csv(
-        os.path.join(DATA_DIR, "title.ratings.tsv"),
-        sep="\t", na_values="\\N"
-    )
+    ratings = read_tsv("title.ratings.tsv")
     movies = movies.merge(ratings, on="tconst", how="inner")
     movies = movies[movies["numVotes"] >= MIN_VOTES].copy()
     print(f"  Movies after vote filter (>= {MIN_VOTES}): {len(movies)}")
 
     # 3. Load title.crew.tsv — get directors
     print("Loading title.crew.tsv...")
-    crew = pd.read_csv(
-        os.path.join(DATA_DIR, "title.crew.tsv"),
-        sep="\t", dtype=str, na_values="\\N",
+    crew = read_tsv(
+        "title.crew.tsv", dtype=str,
         usecols=["tconst", "directors"]
     )
     movies = movies.merge(crew, on="tconst", how="left")
 
     # 4. Load name.basics.tsv — resolve director IDs to names
     print("Loading name.basics.tsv...")
-    names_df = pd.read_csv(
-        os.path.join(DATA_DIR, "name.basics.tsv"),
-        sep="\t", dtype=str, na_values="\\N",
+    names_df = read_tsv(
+        "name.basics.tsv", dtype=str,
         usecols=["nconst", "primaryName", "birthYear", "deathYear", "primaryProfession"]
     )
-    name_lookup = dict(zip(names_df["nconst"], names_df["primaryName"]))
-
-    def resolve_directors(director_ids):
-        if pd.isna(director_ids):
-            return ""
-        ids = director_ids.split(",")
-        resolved = [name_lookup.get(nid, "") for nid in ids]
-        return " ".join([n.replace(" ", "") for n in resolved if n])
-
-    movies["director_names"] = movies["directors"].apply(resolve_directors)
+    # nconst -> name with spaces removed, so each director is a single token
+    name_lookup = (
+        names_df.set_index("nconst")["primaryName"]
+        .dropna()
+        .str.replace(" ", "", regex=False)
+    )
+    name_lookup = name_lookup[~name_lookup.index.duplicated(keep="last")]
+
+    # One row per (movie, director id), resolved and re-joined per movie
+    director_ids = movies["directors"].str.split(",").explode()
+    resolved = director_ids.map(name_lookup).dropna()
+    resolved = resolved[resolved != ""]
+    movies["director_names"] = (
+        resolved.groupby(level=0).agg(" ".join)
+        .reindex(movies.index, fill_value="")
+    )
     movies.drop(columns=["directors"], inplace=True)
 
-    # 5. Build soup feature
-    def create_soup(row):
-        parts = []
-        if pd.notna(row["genres"]):
-            parts.append(row["genres"].replace(",", " "))
-        if row["director_names"]:
-            parts.append(row["director_names"])
-        if pd.notna(row["startYear"]):
-            decade = f"{int(row['startYear'] // 10 * 10)}s"
-            parts.append(decade)
-        return " ".join(parts)
-
-    movies["soup"] = movies.apply(create_soup, axis=1)
+    # 5. Build soup feature (genres + directors + decade)
+    genres_part = movies["genres"].fillna("").str.replace(",", " ", regex=False)
+    decade_part = (
+        (movies["startYear"] // 10 * 10).astype("Int64").astype("string") + "s"
+    ).fillna("")
+    movies["soup"] = (
+        genres_part.str.cat([movies["director_names"], decade_part], sep=" ")
+        .str.replace(r" +", " ", regex=True)
+        .str.strip()
+    )
     movies = movies[movies["soup"].str.strip() != ""].copy()
     movies.reset_index(drop=True, inplace=True)
     print(f"  Final processed movies: {len(movies)}")
@@ -100,71 +116,105 @@ def load_and_process():
     return movies, names_df
 
 
-def df_to_csv_buffer(df):
-    """Convert DataFrame to an in-memory CSV buffer for COPY."""
-    buffer = io.StringIO()
-    df.to_csv(buffer, index=False, header=False, sep="\t", na_rep="\\N")
-    buffer.seek(0)
-    return buffer
+class DataFrameCopyStream:
+    """
+    File-like reader that feeds a DataFrame to COPY a batch of rows at a time.
+
+    Only one batch is serialised to text at any moment, so COPY never needs
+    a CSV copy of the whole DataFrame in memory.
+    """
+
+    def __init__(self, df, batch_rows=100_000):
+        self.df = df
+        self.batch_rows = batch_rows
+        self.pos = 0
+        self.buffer = io.StringIO()
+
+    def _next_batch(self):
+        batch = self.df.iloc[self.pos:self.pos + self.batch_rows]
+        self.pos += self.batch_rows
+        self.buffer = io.StringIO()
+        batch.to_csv(self.buffer, index=False, header=False, sep="\t", na_rep="\\N")
+        self.buffer.seek(0)
+
+    def read(self, size=-1):
+        while True:
+            data = self.buffer.read(size)
+            if data or self.pos >= len(self.df):
+                return data
+            self._next_batch()
+
+
+def copy_df(cur, df, sql):
+    """Stream *df* into PostgreSQL with ``COPY ... FROM STDIN``."""
+    cur.copy_expert(sql, DataFrameCopyStream(df), size=1 << 20)
 
 
 def seed_names(conn, names_df):
-    print("Inserting names via COPY...")
+    print("Inserting names via chunked COPY...")
     start = time.time()
     cur = conn.cursor()
     cur.execute("TRUNCATE TABLE names;")
     conn.commit()
 
-    # Prepare DataFrame columns to match table (convert floats to nullable ints)
-    names_db = pd.DataFrame({
-        "nconst": names_df["nconst"],
-        "primary_name": names_df["primaryName"],
-        "birth_year": pd.to_numeric(names_df["birthYear"], errors="coerce").astype("Int64"),
-        "death_year": pd.to_numeric(names_df["deathYear"], errors="coerce").astype("Int64"),
-        "primary_profession": names_df["primaryProfession"],
-    })
-
-    buffer = df_to_csv_buffer(names_db)
-    cur.copy_expert(
-        "COPY names (nconst, primary_name, birth_year, death_year, primary_profession) FROM STDIN WITH (FORMAT csv, DELIMITER E'\\t', NULL '\\N')",
-        buffer
-    )
-    conn.commit()
+    total_rows = 0
+    for pos in range(0, len(names_df), COPY_CHUNK_ROWS):
+        chunk = names_df.iloc[pos:pos + COPY_CHUNK_ROWS]
+
+        # Prepare DataFrame columns to match table (convert floats to nullable ints)
+        names_db = pd.DataFrame({
+            "nconst": chunk["nconst"],
+            "primary_name": chunk["primaryName"],
+            "birth_year": pd.to_numeric(chunk["birthYear"], errors="coerce").astype("Int64"),
+            "death_year": pd.to_numeric(chunk["deathYear"], errors="coerce").astype("Int64"),
+            "primary_profession": chunk["primaryProfession"],
+        })
+        copy_df(
+            cur, names_db,
+            "COPY names (nconst, primary_name, birth_year, death_year, primary_profession) FROM STDIN WITH (FORMAT csv, DELIMITER E'\\t', NULL '\\N')",
+        )
+        conn.commit()
+        total_rows += len(chunk)
+        print(f"  ... {total_rows:,} rows loaded")
 
     elapsed = time.time() - start
-    print(f"  Names done: {len(names_db):,} rows in {elapsed:.0f}s")
+    print(f"  Names done: {total_rows:,} rows in {elapsed:.0f}s")
 
 
 def seed_movies(conn, movies):
-    print("Inserting movies via COPY...")
+    print("Inserting movies via chunked COPY...")
     start = time.time()
     cur = conn.cursor()
     cur.execute("TRUNCATE TABLE movies;")
     conn.commit()
 
-    # Prepare DataFrame columns to match table (convert floats to nullable ints)
-    movies_db = pd.DataFrame({
-        "tconst": movies["tconst"],
-        "primary_title": movies["primaryTitle"],
-        "original_title": movies.get("originalTitle"),
-        "start_year": movies["startYear"].astype("Int64"),
-        "runtime_minutes": movies["runtimeMinutes"].astype("Int64"),
-        "genres": movies["genres"],
-        "average_rating": movies["averageRating"],
-        "num_votes": movies["numVotes"].astype("Int64"),
-        "director_names": movies["director_names"],
-        "soup": movies["soup"],
-    })
-
-    buffer = df_to_csv_buffer(movies_db)
-    cur.copy_expert(
-        "COPY movies (tconst, primary_title, original_title, start_year, runtime_minutes, genres, average_rating, num_votes, director_names, soup) FROM STDIN WITH (FORMAT csv, DELIMITER E'\\t', NULL '\\N')",
-        buffer
-    )
-    conn.commit()
+    total_rows = 0
+    for pos in range(0, len(movies), COPY_CHUNK_ROWS):
+        chunk = movies.iloc[pos:pos + COPY_CHUNK_ROWS]
+
+        # Prepare DataFrame columns to match table (convert floats to nullable ints)
+        movies_db = pd.DataFrame({
+            "tconst": chunk["tconst"],
+            "primary_title": chunk["primaryTitle"],
+            "original_title": chunk.get("originalTitle"),
+            "start_year": chunk["startYear"].astype("Int64"),
+            "runtime_minutes": chunk["runtimeMinutes"].astype("Int64"),
+            "genres": chunk["genres"],
+            "average_rating": chunk["averageRating"],
+            "num_votes": chunk["numVotes"].astype("Int64"),
+            "director_names": chunk["director_names"],
+            "soup": chunk["soup"],
+        })
+        copy_df(
+            cur, movies_db,
+            "COPY movies (tconst, primary_title, original_title, start_year, runtime_minutes, genres, average_rating, num_votes, director_names, soup) FROM STDIN WITH (FORMAT csv, DELIMITER E'\\t', NULL '\\N')",
+        )
+        conn.commit()
+        total_rows += len(chunk)
+        print(f"  ... {total_rows:,} rows loaded")
 
     elapsed = time.time() - start
-    print(f"  Movies done: {len(movies_db):,} rows in {elapsed:.0f}s")
+    print(f"  Movies done: {total_rows:,} rows in {elapsed:.0f}s")
 
 
 def seed_principals(conn):
@@ -172,18 +222,28 @@ def seed_principals(conn):
     print("Inserting principals via chunked COPY...")
     start = time.time()
     cur = conn.cursor()
+    cur.execute("DROP INDEX IF EXISTS idx_principals_tconst_ordering;")
     cur.execute("TRUNCATE TABLE principals;")
     conn.commit()
 
     tsv_path = os.path.join(DATA_DIR, "title.principals.tsv")
     total_rows = 0
-    chunk_size = 5_000_000
-
-    for chunk in pd.read_csv(
-        tsv_path, sep="\t", dtype=str, na_values="\\N",
-        usecols=["tconst", "ordering", "nconst", "category", "job", "characters"],
-        chunksize=chunk_size
-    ):
+    columns = ["tconst", "ordering", "nconst", "category", "job", "characters"]
+
+    # Stream record batches from pyarrow's parallel CSV reader
+    reader = pa_csv.open_csv(
+        tsv_path,
+        read_options=pa_csv.ReadOptions(block_size=256 << 20),
+        parse_options=pa_csv.ParseOptions(delimiter="\t"),
+        convert_options=pa_csv.ConvertOptions(
+            include_columns=columns,
+            column_types={c: pa.string() for c in columns},
+            null_values=["\\N"],
+            strings_can_be_null=True,
+        ),
+    )
+    for batch in reader:
+        chunk = batch.to_pandas(types_mapper=pd.ArrowDtype)
         chunk["ordering"] = pd.to_numeric(chunk["ordering"], errors="coerce").astype("Int64")
         principals_db = pd.DataFrame({
             "tconst": chunk["tconst"],
@@ -193,15 +253,18 @@ def seed_principals(conn):
             "job": chunk["job"],
             "characters": chunk["characters"],
         })
-        buffer = df_to_csv_buffer(principals_db)
-        cur.copy_expert(
+        copy_df(
+            cur, principals_db,
             "COPY principals (tconst, ordering, nconst, category, job, characters) FROM STDIN WITH (FORMAT csv, DELIMITER E'\\t', NULL '\\N')",
-            buffer
         )
         conn.commit()
         total_rows += len(chunk)
         print(f"  ... {total_rows:,} rows loaded")
 
+    print("  Rebuilding principals (tconst, ordering) index...")
+    cur.execute(PRINCIPALS_INDEX_SQL)
+    conn.commit()
+
     elapsed = time.time() - start
     print(f"  Principals done: {total_rows:,} rows in {elapsed:.0f}s")
 
@@ -239,7 +302,7 @@ def main():
 
     print("\nConnecting to database...")
     ensure_database()
-    conn = get_connection()
+    conn = connect()
 
     create_tables(conn)
     seed_names(conn, names_df)
@@ -1,9 +1,65 @@
 import os
+from collections import defaultdict
+
 import joblib
+import numpy as np
+import scipy.sparse as sp
+from sklearn.preprocessing import normalize
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 MODELS_DIR = os.path.join(BASE_DIR, "model", "models")
 
+
+def _load_tfidf_matrix():
+    """
+    Load the row-normalised float32 CSR TF-IDF matrix.
+
+    The CSR arrays are memory-mapped read-only, so every API worker shares
+    the same page-cache pages instead of holding its own copy. Artifacts
+    from before the .npy format are loaded with joblib and normalised here.
+    """
+    shape_path = os.path.join(MODELS_DIR, "tfidf_shape.npy")
+    if os.path.exists(shape_path):
+        data = np.load(os.path.join(MODELS_DIR, "tfidf_data.npy"), mmap_mode="r")
+        indices = np.load(os.path.join(MODELS_DIR, "tfidf_indices.npy"), mmap_mode="r")
+        indptr = np.load(os.path.join(MODELS_DIR, "tfidf_indptr.npy"), mmap_mode="r")
+        shape = tuple(np.load(shape_path))
+        return sp.csr_matrix((data, indices, indptr), shape=shape, copy=False)
+
+    # L2-normalise once so cosine similarity is a plain sparse dot product
+    matrix = joblib.load(os.path.join(MODELS_DIR, "tfidf_matrix.pkl"))
+    matrix = matrix.tocsr().astype(np.float32, copy=False)
+    return normalize(matrix, norm="l2", copy=False)
+
+
 movies = joblib.load(os.path.join(MODELS_DIR, "movies_df.pkl"))
-tfidf_matrix = joblib.load(os.path.join(MODELS_DIR, "tfidf_matrix.pkl"))
+tfidf_matrix = _load_tfidf_matrix()
 tfidf = joblib.load(os.path.join(MODELS_DIR, "tfidf_vectorizer.pkl"))
+
+# Lowercased titles are precomputed by train_model.py. Older artifacts lack
+# them, and a run that failed mid-save can leave a stale list that no longer
+# lines up with movies_df.pkl, so recompute in either case.
+titles_lower = None
+_titles_path = os.path.join(MODELS_DIR, "titles_lower.pkl")
+if os.path.exists(_titles_path):
+    titles_lower = joblib.load(_titles_path)
+if titles_lower is None or len(titles_lower) != len(movies):
+    titles_lower = [t.lower() for t in movies["primaryTitle"].values]
+
+# Lowercased title -> row position of its most-voted movie, for O(1) lookup
+title_best_idx = (
+    movies["numVotes"].fillna(0).groupby(titles_lower).idxmax().to_dict()
+)
+
+
+def _build_bigram_index(titles):
+    """Map each character bigram to the sorted int32 row positions containing it."""
+    postings = defaultdict(list)
+    for i, t in enumerate(titles):
+        for bigram in {t[j:j + 2] for j in range(len(t) - 1)}:
+            postings[bigram].append(i)
+    return {bg: np.array(rows, dtype=np.int32) for bg, rows in postings.items()}
+
+
+# Character bigram -> row positions, for substring search without a full scan
+bigram_index = _build_bigram_index(titles_lower)
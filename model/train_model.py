@@ -10,6 +10,7 @@ import sys
 import joblib
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
+from sklearn.preprocessing import normalize
 
 # Add project root to path so we can import database.connection
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -22,9 +23,9 @@ print("Setup done!")
 
 # ── 1. Load movies from PostgreSQL ──────────────────────────────────────────
 
-from database.connection import get_connection
+from database.connection import connect
 
-conn = get_connection()
+conn = connect()
 
 movies = pd.read_sql("""
     SELECT tconst, primary_title AS "primaryTitle",
@@ -55,6 +56,13 @@ tfidf = TfidfVectorizer(
 )
 tfidf_matrix = tfidf.fit_transform(movies["soup"])
 
+# float32 halves the bytes the API streams through each similarity matmul;
+# ranking is unaffected by the lost precision. Rows are L2-normalised here
+# so the API can memory-map the saved arrays without modifying them.
+tfidf_matrix = tfidf_matrix.astype(np.float32).tocsr()
+tfidf_matrix = normalize(tfidf_matrix, norm="l2", copy=False)
+tfidf_matrix.sort_indices()
+
 print(f"TF-IDF matrix shape: {tfidf_matrix.shape}")
 print(f"TF-IDF matrix memory: {tfidf_matrix.data.nbytes / 1024 / 1024:.1f} MB")
 
@@ -66,8 +74,15 @@ save_cols = ["tconst", "primaryTitle", "startYear", "genres", "averageRating",
 movies_save = movies[save_cols].copy()
 
 joblib.dump(movies_save, os.path.join(MODEL_DIR, "movies_df.pkl"))
-joblib.dump(tfidf_matrix, os.path.join(MODEL_DIR, "tfidf_matrix.pkl"))
+# TF-IDF CSR arrays as raw .npy so API workers can memory-map and share them
+np.save(os.path.join(MODEL_DIR, "tfidf_data.npy"), tfidf_matrix.data)
+np.save(os.path.join(MODEL_DIR, "tfidf_indices.npy"), tfidf_matrix.indices)
+np.save(os.path.join(MODEL_DIR, "tfidf_indptr.npy"), tfidf_matrix.indptr)
+np.save(os.path.join(MODEL_DIR, "tfidf_shape.npy"), np.array(tfidf_matrix.shape))
 joblib.dump(tfidf, os.path.join(MODEL_DIR, "tfidf_vectorizer.pkl"))
+# Lowercased titles for the API's title lookups, so workers skip this at boot
+joblib.dump([t.lower() for t in movies_save["primaryTitle"]],
+            os.path.join(MODEL_DIR, "titles_lower.pkl"))
 
 print("Artifacts saved to models/:")
 for f in os.listdir(MODEL_DIR):
@@ -91,7 +106,8 @@ def recommend(title, n=10):
 
     sim_scores = cosine_similarity(tfidf_matrix[idx], tfidf_matrix).flatten()
     sim_scores[idx] = -1  # Exclude self
-    top_indices = sim_scores.argsort()[-n:][::-1]
+    top = np.argpartition(sim_scores, -n)[-n:]
+    top_indices = top[np.argsort(sim_scores[top])[::-1]]
 
     results = movies.iloc[top_indices][["primaryTitle", "startYear", "genres", "averageRating"]].copy()
     results["similarity"] = sim_scores[top_indices]